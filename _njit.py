@@ -0,0 +1,21 @@
+"""
+_njit.py
+Numba 選用依賴封裝：有安裝 numba 時 njit 即 numba.njit，
+否則原樣回傳函數（不編譯），呼叫端可依 NUMBA_AVAILABLE 改走 NumPy / pandas 路徑
+"""
+
+try:
+    from numba import njit as _numba_njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    _numba_njit = None
+    NUMBA_AVAILABLE = False
+
+
+def njit(*args, **kwargs):
+    if NUMBA_AVAILABLE:
+        return _numba_njit(*args, **kwargs)
+    # 支援 @njit 與 @njit(cache=True) 兩種寫法
+    if len(args) == 1 and callable(args[0]) and not kwargs:
+        return args[0]
+    return lambda func: func
@@ -5,6 +5,7 @@ analysis.py — SHEN XIV（已全面遷移至 FMP，移除 yfinance）
 import requests
 import streamlit as st
 from typing import Optional
+from fmp_client import API_KEY, BASE_URL, fmp_request
 
 # ==================== 產業別 PE 基準表 ====================
 SECTOR_PE_BENCHMARKS = {
@@ -20,55 +21,81 @@ SECTOR_MARGIN_BENCHMARKS = {
     "Utilities": 0.12, "Real Estate": 0.20, "default": 0.10,
 }
 
+@st.cache_data(ttl=86400, show_spinner=False)
+def _get_sector(clean: str) -> str:
+    """產業別幾乎不變，profile 請求獨立快取一天；HTTP 失敗直接拋出，例外不會被快取"""
+    data = fmp_request(f"{BASE_URL}/profile/{clean}")
+    # FMP 可能以 200 回傳錯誤 dict（如 {"Error Message": ...}），只有非空 list 才取產業別
+    if not isinstance(data, list) or not data or not isinstance(data[0], dict):
+        return "default"
+    return data[0].get("sector") or "default"
+
+
 def get_financial_health(ticker: str) -> Optional[dict]:
-    """完全使用 FMP（支援 .TW、^TWII、美股等）"""
-    api_key = st.secrets.get("FMP_API_KEY", "").strip()
-    if not api_key:
+    """
+    完全使用 FMP（支援 .TW、^TWII、美股等）
+    - 限流 / 伺服器錯誤 / 斷線在此顯示錯誤；例外不進 st.cache_data，下次重跑會再查
+    """
+    try:
+        return _get_financial_health(ticker)
+    except (requests.RequestException, ValueError) as e:
+        st.error(f"FMP 財務分析失敗 ({ticker}): {e}")
+        return None
+
+
+def _is_no_data(e: requests.HTTPError) -> bool:
+    """429 以外的 4xx（如指數無基本面）視同無資料；429 / 5xx 屬暫時性錯誤"""
+    status = e.response.status_code if e.response is not None else None
+    return status is not None and 400 <= status < 500 and status != 429
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def _get_financial_health(ticker: str) -> Optional[dict]:
+    """
+    key-metrics-ttm 每 15 分鐘更新；profile 只用來取產業別，走一天的獨立快取
+    - 429 / 5xx / 斷線直接拋出：例外不會被快取，不會把暫時性錯誤當成「無資料」快取 15 分鐘
+    """
+    if not API_KEY:
         st.error("❌ FMP_API_KEY 未設定")
         return None
 
+    clean = ticker.replace("^", "").upper()
     try:
-        clean = ticker.replace("^", "").upper()
-        # key-metrics + profile
-        m_resp = requests.get(
-            f"https://financialmodelingprep.com/api/v3/key-metrics-ttm/{clean}?apikey={api_key}",
-            timeout=7
-        )
-        p_resp = requests.get(
-            f"https://financialmodelingprep.com/api/v3/profile/{clean}?apikey={api_key}",
-            timeout=7
-        )
-
-        m_data = m_resp.json() if m_resp.ok else []
-        p_data = p_resp.json() if p_resp.ok else []
-
-        if not m_data or not isinstance(m_data, list):
-            return None
-
-        m = m_data[0]
-        sector = p_data[0].get("sector", "default") if p_data else "default"
-
-        analysis = {
-            "sector": sector,
-            "pe_status": "N/A", "roe_status": "N/A", "margin_status": "N/A",
-            "debt_status": "N/A", "growth_status": "N/A",
-            "health_score": 0, "insight": "",
-            "data": {
-                "PE": m.get("peRatioTTM"), "Forward PE": m.get("forwardPE"),
-                "PEG": m.get("pegRatioTTM"), "ROE": m.get("roeTTM"),
-                "Profit Margin": m.get("netProfitMarginTTM"),
-                "Gross Margin": m.get("grossProfitMarginTTM"),
-                "Beta": m.get("betaTTM", 0),
-                "D/E Ratio": m.get("debtToEquityTTM"),
-                "Current Ratio": m.get("currentRatioTTM"),
-                "Revenue Growth": m.get("revenueGrowthTTM"),
-            }
-        }
-        return _evaluate_metrics(analysis)
-
-    except Exception as e:
-        st.error(f"FMP 財務分析失敗 ({ticker}): {e}")
+        # 走 fmp_client.fmp_request：共用 keep-alive Session，429 / 5xx / 斷線自動退避重試
+        m_data = fmp_request(f"{BASE_URL}/key-metrics-ttm/{clean}")
+    except requests.HTTPError as e:
+        if not _is_no_data(e):
+            raise
+        return None   # 429 以外的 4xx 視同無資料，不顯示錯誤
+
+    if not isinstance(m_data, list) or not m_data or not isinstance(m_data[0], dict):
         return None
+    return _build_analysis(m_data[0], clean)
+
+
+def _build_analysis(m: dict, clean: str) -> dict:
+    try:
+        sector = _get_sector(clean)
+    except (requests.RequestException, ValueError):
+        sector = "default"
+
+    analysis = {
+        "sector": sector,
+        "pe_status": "N/A", "roe_status": "N/A", "margin_status": "N/A",
+        "debt_status": "N/A", "growth_status": "N/A",
+        "health_score": 0, "insight": "",
+        "data": {
+            "PE": m.get("peRatioTTM"), "Forward PE": m.get("forwardPE"),
+            "PEG": m.get("pegRatioTTM"), "ROE": m.get("roeTTM"),
+            "Profit Margin": m.get("netProfitMarginTTM"),
+            "Gross Margin": m.get("grossProfitMarginTTM"),
+            "Beta": m.get("betaTTM", 0),
+            "D/E Ratio": m.get("debtToEquityTTM"),
+            "Current Ratio": m.get("currentRatioTTM"),
+            "Revenue Growth": m.get("revenueGrowthTTM"),
+        }
+    }
+    return _evaluate_metrics(analysis)
 
 
 # ==================== 評分引擎 ====================
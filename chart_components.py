@@ -3,93 +3,201 @@ chart_components.py
 負責 Plotly 圖表的繪製邏輯 (包含動態面積圖與漲跌變色)
 """
 import plotly.graph_objects as go
+import plotly.io as pio
 from plotly.subplots import make_subplots
+import numpy as np
 import pandas as pd
-import pytz
-from typing import Optional
+import streamlit as st
+from typing import Optional, Tuple
+from zoneinfo import ZoneInfo
 from config import COLORS
+from utils import lttb
+
+_TW_TZ = ZoneInfo("Asia/Taipei")
+
+# 色票在 import 時解開成模組常數，建圖時不再逐一查 dict
+(_PRIMARY, _DANGER, _WARNING, _INFO, _TEXT,
+ _GRID, _BG, _FILL_GREEN, _FILL_RED) = (COLORS[k] for k in (
+    "primary", "danger", "warning", "info", "text",
+    "grid", "bg_transparent", "fill_green", "fill_red"))
+
+
+# 只放與 Streamlit 主題無關的設定：st.plotly_chart 預設 theme="streamlit" 會把自家字型 / 背景 / 邊距
+# 合併進 layout.template.layout，這些樣式必須留在 layout 本身才不會被主題蓋掉
+# 以目前的預設 template 為底（import streamlit 後即為 "streamlit" 佔位樣式），與未掛 template 時一致
+_TEMPLATE = go.layout.Template(pio.templates[pio.templates.default])
+_TEMPLATE.layout.update(
+    showlegend=False,
+    hovermode="x unified",
+)
 
 
 def _apply_common_layout(fig, height=500):
     fig.update_layout(
+        template=_TEMPLATE,
         height=height,
         margin=dict(l=10, r=10, t=30, b=10),
-        paper_bgcolor=COLORS["bg_transparent"],
-        plot_bgcolor=COLORS["bg_transparent"],
+        paper_bgcolor=_BG,
+        plot_bgcolor=_BG,
         font=dict(family="Roboto Mono, monospace", color="#aaa"),
-        xaxis_rangeslider_visible=False,
-        showlegend=False,
-        hovermode="x unified"
+        xaxis_rangeslider_visible=False,   # K 線圖會主動開啟 rangeslider，明確關閉不靠 template 預設
+        # uirevision 不變時，前端以 Plotly.react 只重繪變動的 trace，縮放 / 平移狀態保留
+        uirevision="stock-dash",
     )
     return fig
 
-def create_intraday_chart(df: pd.DataFrame, title: str) -> Optional[go.Figure]:
-    if df.empty: return None
-    
-    df = df.copy()
-    
-    # 時區處理
-    if pd.api.types.is_datetime64_any_dtype(df.index):
-        if df.index.tz is not None:
-            tw_tz = pytz.timezone("Asia/Taipei")
-            df["Datetime"] = df.index.tz_convert(tw_tz).tz_localize(None)
-        else:
-            df["Datetime"] = df.index
-    else:
-        df["Datetime"] = pd.to_datetime(df.index)
+def _f32(s: pd.Series) -> np.ndarray:
+    """繪圖用數列轉 float32：Plotly 以 typed array 序列化，payload 減半，精度對圖形綽綽有餘"""
+    return s.to_numpy(dtype=np.float32)
 
-    # === 動態漲跌變色與面積圖邏輯 ===
-    start_price = df["Close"].iloc[0]
-    end_price = df["Close"].iloc[-1]
-    
-    # 判斷漲跌顏色
-    if end_price >= start_price:
-        line_color = COLORS["primary"]   # 綠 (漲)
-        fill_color = COLORS["fill_green"] # 半透明綠
-    else:
-        line_color = COLORS["danger"]    # 紅 (跌)
-        fill_color = COLORS["fill_red"]   # 半透明紅
+# ==================== 骨架快取 ====================
+# 版面 / subplot / 參考線只在 session 第一次建立，之後重跑只替換 trace 資料
+
+def _get_skeleton(key: str, builder):
+    fig = st.session_state.get(key)
+    if fig is None:
+        fig = builder()
+        st.session_state[key] = fig
+    return fig
+
+
+def _fingerprint(df: pd.DataFrame, title: str) -> tuple:
+    """指紋：標題 + 時間 / OHLCV 內容雜湊（向量化計算，遠比 Plotly 重新驗證整批陣列便宜）"""
+    cols = [c for c in ("Date", "Open", "High", "Low", "Close", "Volume") if c in df.columns]
+    return title, len(df), int(pd.util.hash_pandas_object(df[cols]).sum())
 
+
+def _is_current(key: str, fp: tuple) -> bool:
+    """
+    骨架內已是同一份資料時回傳 True（重跑只是切換無關的 widget），可直接沿用、不必重填 trace
+    - 不相符時先清掉舊指紋：重填途中失敗的話，下次重跑不會誤用填到一半的骨架
+    - 新指紋由呼叫端在 batch_update 成功後以 _mark_current 寫入
+    """
+    if key in st.session_state and st.session_state.get(key + "_fp") == fp:
+        return True
+    st.session_state.pop(key + "_fp", None)
+    return False
+
+
+def _mark_current(key: str, fp: tuple) -> None:
+    st.session_state[key + "_fp"] = fp
+
+
+def _build_intraday_skeleton() -> go.Figure:
     fig = make_subplots(
         rows=2, cols=1, shared_xaxes=True,
         vertical_spacing=0.05, row_heights=[0.8, 0.2]
     )
 
     # 1. 價格線 (Area Chart) - 關鍵在 fill='tozeroy'
-    fig.add_trace(go.Scatter(
-        x=df["Datetime"], y=df["Close"],
-        mode="lines", 
+    # 1 分 K 動輒上千點，線型 trace 一律用 Scattergl（WebGL 繪製，不逐點產生 SVG 節點）
+    fig.add_trace(go.Scattergl(
+        mode="lines",
         name="PRICE",
-        line=dict(color=line_color, width=2),
+        line=dict(width=2),
         fill='tozeroy',       # <--- 這裡讓它變成面積圖
-        fillcolor=fill_color  # <--- 這裡設定填充顏色
     ), row=1, col=1)
 
-    # 參考線：開盤價
-    fig.add_hline(y=start_price, line_dash="dot", line_color="#666", row=1, col=1)
+    # 參考線：開盤價（y 值於填資料時設定）
+    fig.add_hline(y=0, line_dash="dot", line_color="#666", row=1, col=1)
 
     # 2. 成交量
-    colors = [COLORS["danger"] if c < o else COLORS["primary"] for o, c in zip(df["Open"], df["Close"])]
-    fig.add_trace(go.Bar(
-        x=df["Datetime"], y=df["Volume"],
-        name="VOL", marker_color=colors
-    ), row=2, col=1)
+    fig.add_trace(go.Bar(name="VOL"), row=2, col=1)
 
-    fig.update_layout(title=dict(text=f"<b>{title}</b>", font=dict(size=18, color=COLORS["text"])))
+    fig.update_layout(title=dict(font=dict(size=18, color=_TEXT)))
     fig = _apply_common_layout(fig)
+    fig.update_yaxes(gridcolor=_GRID, row=1, col=1)
+    fig.update_xaxes(showgrid=False, tickformat="%H:%M", row=2, col=1)
+    return fig
+
+
+INTRADAY_MAX_POINTS = 600   # 送進瀏覽器的最大 K 棒數
+
+
+def _intraday_times(df: pd.DataFrame) -> np.ndarray:
+    """
+    繪圖用時間軸（naive 台北時間）：只產生一個本地陣列，不複製整張 DataFrame 來掛欄位
+    - FMP 的時間在 Date 欄（索引是 RangeIndex，已是 naive 交易所時間），舊資料源則在索引
+    - 帶時區的來源才轉換成台北時間
+    """
+    ts = pd.DatetimeIndex(df["Date"] if "Date" in df.columns else df.index)
+    if ts.tz is not None:
+        ts = ts.tz_convert(_TW_TZ).tz_localize(None)
+    return ts.to_numpy()
+
+
+def _downsample_bars(ts: np.ndarray, df: pd.DataFrame,
+                     max_points: int = INTRADAY_MAX_POINTS) -> Tuple[np.ndarray, ...]:
+    """
+    分桶合併 K 棒（Open 取首筆、Close 取末筆、Volume 加總），點數壓到 max_points 以下
+    - 與單純 iloc[::stride] 不同，不會漏掉被跳過那幾根的成交量
+    - 回傳 (時間, Open, Close, Volume) 陣列，不另建 DataFrame
+    """
+    opens, closes = df["Open"].to_numpy(), df["Close"].to_numpy()
+    n = len(df)
+    if n <= max_points:
+        return ts, opens, closes, df["Volume"].to_numpy()
+    starts = np.arange(0, n, -(-n // max_points))
+    ends   = np.append(starts[1:], n) - 1
+    # Volume 可能已降為窄整數型別，加總前先轉 float64 以免溢位
+    volume = np.add.reduceat(df["Volume"].to_numpy(dtype=np.float64), starts)
+    return ts[starts], opens[starts], closes[ends], volume
+
+
+def create_intraday_chart(df: pd.DataFrame, title: str) -> Optional[go.Figure]:
+    if df.empty: return None
+    fp = _fingerprint(df, title)
+    if _is_current("intraday_skel", fp):
+        return st.session_state["intraday_skel"]
+    
+    ts = _intraday_times(df)
+
+    # === 動態漲跌變色與面積圖邏輯 ===
+    start_price = df["Close"].iloc[0]
+    end_price = df["Close"].iloc[-1]
     
-    # Y軸自動縮放優化
+    # 判斷漲跌顏色
+    if end_price >= start_price:
+        line_color = _PRIMARY      # 綠 (漲)
+        fill_color = _FILL_GREEN   # 半透明綠
+    else:
+        line_color = _DANGER       # 紅 (跌)
+        fill_color = _FILL_RED     # 半透明紅
+
+    # Y軸自動縮放優化（以完整資料計算，降採樣後高低點仍在範圍內）
     min_val = df["Low"].min()
     max_val = df["High"].max()
     padding = (max_val - min_val) * 0.1 if max_val != min_val else max_val * 0.01
-    fig.update_yaxes(range=[min_val - padding, max_val + padding], row=1, col=1, gridcolor=COLORS["grid"])
-    fig.update_xaxes(showgrid=False, tickformat="%H:%M", row=2, col=1)
+
+    # 價格線以 LTTB 挑點（保留尖峰 / 低谷的形狀）；成交量柱改走分桶加總，量不會被跳過
+    close = df["Close"].to_numpy(dtype=np.float64)
+    idx   = lttb(ts.astype("datetime64[ns]").astype(np.float64), close, INTRADAY_MAX_POINTS)
+    bar_ts, bar_open, bar_close, bar_vol = _downsample_bars(ts, df)
+    colors = np.where(bar_close < bar_open, _DANGER, _PRIMARY)
+
+    fig = _get_skeleton("intraday_skel", _build_intraday_skeleton)
+    with fig.batch_update():
+        fig.data[0].update(x=ts[idx], y=close[idx].astype(np.float32),
+                           line_color=line_color, fillcolor=fill_color)
+        fig.data[1].update(x=bar_ts, y=bar_vol.astype(np.float32), marker_color=colors)
+        fig.layout.shapes[0].update(y0=start_price, y1=start_price)
+        fig.layout.title.text = f"<b>{title}</b>"
+        fig.layout.uirevision = title   # 換標的才重置縮放；同一檔每分鐘刷新保留視角
+        fig.update_yaxes(range=[min_val - padding, max_val + padding], row=1, col=1)
+    _mark_current("intraday_skel", fp)
     
     return fig
 
-def create_candlestick_chart(df: pd.DataFrame, title: str) -> Optional[go.Figure]:
-    if df.empty: return None
 
+# 線型 trace 名稱 → DataFrame 欄位
+_CANDLE_LINE_COLUMNS = {
+    "5MA": "SMA5", "20MA": "SMA20",
+    "BB_Upper": "BB_Upper", "BB_Lower": "BB_Lower", "RSI": "RSI",
+}
+
+
+def _build_candlestick_skeleton(has_sma5: bool, has_sma20: bool,
+                                has_bb: bool, has_rsi: bool) -> go.Figure:
     fig = make_subplots(
         rows=2, cols=1, shared_xaxes=True,
         vertical_spacing=0.03, row_heights=[0.7, 0.3]
@@ -97,49 +205,106 @@ def create_candlestick_chart(df: pd.DataFrame, title: str) -> Optional[go.Figure
 
     # K線
     fig.add_trace(go.Candlestick(
-        x=df["Date"], open=df["Open"], high=df["High"],
-        low=df["Low"], close=df["Close"], name="OHLC",
-        increasing_line_color=COLORS["primary"], increasing_fillcolor=COLORS["fill_green"],
-        decreasing_line_color=COLORS["danger"], decreasing_fillcolor=COLORS["fill_red"],
+        name="OHLC",
+        increasing_line_color=_PRIMARY, increasing_fillcolor=_FILL_GREEN,
+        decreasing_line_color=_DANGER, decreasing_fillcolor=_FILL_RED,
     ), row=1, col=1)
 
     # MA 指標
-    if "SMA5" in df.columns:
-        fig.add_trace(go.Scatter(x=df["Date"], y=df["SMA5"], line=dict(color=COLORS["warning"], width=1), name="5MA"), row=1, col=1)
-    if "SMA20" in df.columns:
-        fig.add_trace(go.Scatter(x=df["Date"], y=df["SMA20"], line=dict(color=COLORS["info"], width=1), name="20MA"), row=1, col=1)
+    if has_sma5:
+        fig.add_trace(go.Scattergl(line=dict(color=_WARNING, width=1), name="5MA"), row=1, col=1)
+    if has_sma20:
+        fig.add_trace(go.Scattergl(line=dict(color=_INFO, width=1), name="20MA"), row=1, col=1)
     
-    # 布林通道
-    if "BB_Upper" in df.columns:
-        fig.add_trace(go.Scatter(x=df['Date'], y=df['BB_Upper'], line=dict(color='rgba(150, 150, 150, 0.3)', width=1, dash='dot'), showlegend=False), row=1, col=1)
-        fig.add_trace(go.Scatter(x=df['Date'], y=df['BB_Lower'], line=dict(color='rgba(150, 150, 150, 0.3)', width=1, dash='dot'), fill='tonexty', fillcolor='rgba(150, 150, 150, 0.05)', showlegend=False), row=1, col=1)
+    # 布林通道（Scattergl 支援 tonexty，上下軌同為 GL trace 即可填色）
+    if has_bb:
+        fig.add_trace(go.Scattergl(line=dict(color='rgba(150, 150, 150, 0.3)', width=1, dash='dot'), name="BB_Upper", showlegend=False), row=1, col=1)
+        fig.add_trace(go.Scattergl(line=dict(color='rgba(150, 150, 150, 0.3)', width=1, dash='dot'), name="BB_Lower", fill='tonexty', fillcolor='rgba(150, 150, 150, 0.05)', showlegend=False), row=1, col=1)
 
     # RSI
-    if "RSI" in df.columns:
-        fig.add_trace(go.Scatter(x=df["Date"], y=df["RSI"], line=dict(color="#bd00ff", width=2), name="RSI"), row=2, col=1)
-        fig.add_hline(y=70, line_dash="dot", line_color=COLORS["danger"], row=2, col=1)
-        fig.add_hline(y=30, line_dash="dot", line_color=COLORS["primary"], row=2, col=1)
+    if has_rsi:
+        fig.add_trace(go.Scattergl(line=dict(color="#bd00ff", width=2), name="RSI"), row=2, col=1)
+        fig.add_hline(y=70, line_dash="dot", line_color=_DANGER, row=2, col=1)
+        fig.add_hline(y=30, line_dash="dot", line_color=_PRIMARY, row=2, col=1)
 
     fig = _apply_common_layout(fig, height=700)
-    fig.update_layout(title=dict(text=f"<b>{title}</b>", font=dict(size=18, color=COLORS["text"])))
-    fig.update_yaxes(gridcolor=COLORS["grid"], row=1, col=1)
+    fig.update_layout(title=dict(font=dict(size=18, color=_TEXT)))
+    fig.update_yaxes(gridcolor=_GRID, row=1, col=1)
     fig.update_yaxes(range=[0, 100], row=2, col=1)
+    return fig
+
+
+def create_candlestick_chart(df: pd.DataFrame, title: str) -> Optional[go.Figure]:
+    if df.empty: return None
+
+    # 指標欄位組合不同 → trace 結構不同，各自一份骨架
+    flags = tuple(c in df.columns for c in ("SMA5", "SMA20", "BB_Upper", "RSI"))
+    key   = "candle_skel_" + "".join("1" if f else "0" for f in flags)
+    fp    = _fingerprint(df, title)
+    if _is_current(key, fp):
+        return st.session_state[key]
+    fig   = _get_skeleton(key, lambda: _build_candlestick_skeleton(*flags))
+
+    x = df["Date"]
+    with fig.batch_update():
+        for trace in fig.data:
+            if trace.type == "candlestick":
+                trace.update(x=x, open=df["Open"], high=df["High"],
+                             low=df["Low"], close=df["Close"])
+            else:
+                trace.update(x=x, y=_f32(df[_CANDLE_LINE_COLUMNS[trace.name]]))
+        fig.layout.title.text = f"<b>{title}</b>"
+        fig.layout.uirevision = title
+    _mark_current(key, fp)
     
     return fig
 
+def _build_macd_skeleton() -> go.Figure:
+    fig = go.Figure()
+    fig.add_trace(go.Scattergl(line=dict(color=_INFO, width=1.5), name="MACD"))
+    fig.add_trace(go.Scattergl(line=dict(color=_WARNING, width=1.5, dash="dot"), name="Signal"))
+    fig.add_trace(go.Bar(name="Histogram"))
+    fig = _apply_common_layout(fig, height=180)
+    fig.update_layout(margin=dict(l=10, r=10, t=25, b=10), title="MACD", showlegend=True)
+    fig.update_yaxes(gridcolor=_GRID)
+    return fig
+
+
+def create_macd_chart(df: pd.DataFrame, title: str) -> Optional[go.Figure]:
+    """MACD 面板（需有 MACD / Signal 欄）；柱狀圖直接以 ndarray 相減，不建中間 Series"""
+    if df.empty or "MACD" not in df.columns: return None
+    fp = _fingerprint(df, title)
+    if _is_current("macd_skel", fp):
+        return st.session_state["macd_skel"]
+
+    macd   = df["MACD"].to_numpy()
+    signal = df["Signal"].to_numpy()
+    hist   = macd - signal
+
+    fig = _get_skeleton("macd_skel", _build_macd_skeleton)
+    with fig.batch_update():
+        fig.data[0].update(x=df["Date"], y=macd.astype(np.float32))
+        fig.data[1].update(x=df["Date"], y=signal.astype(np.float32))
+        fig.data[2].update(x=df["Date"], y=hist.astype(np.float32),
+                           marker_color=np.where(hist >= 0, _PRIMARY, _DANGER))
+        fig.layout.uirevision = title
+    _mark_current("macd_skel", fp)
+    return fig
+
+
 def create_comparison_chart(df: pd.DataFrame, name_main: str, name_bench: str) -> Optional[go.Figure]:
     if df.empty: return None
 
     fig = go.Figure()
     
-    fig.add_trace(go.Scatter(
-        x=df["Date"], y=df["Return_Main"],
+    fig.add_trace(go.Scattergl(
+        x=df["Date"], y=_f32(df["Return_Main"]),
         mode="lines", name=name_main,
-        line=dict(color=COLORS["primary"], width=3)
+        line=dict(color=_PRIMARY, width=3)
     ))
     
-    fig.add_trace(go.Scatter(
-        x=df["Date"], y=df["Return_Bench"],
+    fig.add_trace(go.Scattergl(
+        x=df["Date"], y=_f32(df["Return_Bench"]),
         mode="lines", name=name_bench,
         line=dict(color="#666", width=2, dash="dot")
     ))
@@ -150,41 +315,10 @@ def create_comparison_chart(df: pd.DataFrame, name_main: str, name_bench: str) -
     fig.update_layout(
         title="<b>PERFORMANCE DELTA (%)</b>",
         yaxis_title="RETURN (%)",
-        hovermode="x unified"
+        hovermode="x unified",
+        uirevision=f"{name_main}|{name_bench}",
+        xaxis_uirevision=f"{name_main}|{name_bench}",
     )
-    fig.update_yaxes(gridcolor=COLORS["grid"])
+    fig.update_yaxes(gridcolor=_GRID)
     
     return fig
-
-
-# ==================== 新增：Sparkline 迷你走勢圖 ====================
-def create_sparkline(df: pd.DataFrame, symbol: str, change_pct: float) -> go.Figure:
-    """iOS 風格 Sparkline（高 40px、明顯波動、上漲綠 / 下跌紅 + 陰影填充）"""
-    line_color = "#00ff41" if change_pct >= 0 else "#ff0055"   # 上漲綠 / 下跌紅
-    fill_color = "rgba(0, 255, 65, 0.22)" if change_pct >= 0 else "rgba(255, 0, 85, 0.22)"
-    
-    min_p = df["Close"].min()
-    max_p = df["Close"].max()
-    padding = (max_p - min_p) * 0.012
-    
-    fig = go.Figure()
-    fig.add_trace(go.Scatter(
-        x=df.index,
-        y=df["Close"],
-        mode="lines",
-        line=dict(color=line_color, width=2.8),
-        fill="tozeroy",
-        fillcolor=fill_color
-    ))
-    
-    fig.update_layout(
-        height=40,
-        width=140,
-        margin=dict(l=0, r=0, t=0, b=0),
-        paper_bgcolor="rgba(0,0,0,0)",
-        plot_bgcolor="rgba(0,0,0,0)",
-        showlegend=False,
-        xaxis=dict(visible=False),
-        yaxis=dict(visible=False, range=[min_p - padding, max_p + padding])
-    )
-    return fig
\ No newline at end of file
@@ -3,6 +3,8 @@ config.py
 SHEN XIII TACTICAL 的全域配置參數
 """
 
+import re
+
 # --- 色票系統 (Tactical Theme) ---
 COLORS = {
     "primary": "#00ff41",    # 駭客綠 (上漲/主色)
@@ -17,7 +19,14 @@ COLORS = {
 }
 
 # --- CSS 樣式 ---
-CUSTOM_CSS = f"""
+def _minify_css(css: str) -> str:
+    """去除註解與多餘空白（import 時執行一次，縮小每次重跑送出的 CSS）"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    return re.sub(r"\s*([{};:,>])\s*", r"\1", css).strip()
+
+
+CUSTOM_CSS = _minify_css(f"""
     <style>
         @import url('https://fonts.googleapis.com/css2?family=Roboto+Mono:wght@400;700&display=swap');
 
@@ -80,8 +89,29 @@ CUSTOM_CSS = f"""
             border: none !important;
             display: block;
         }}
+
+        /* 8. Metric Grid（單一 markdown 取代多個 st.metric） */
+        .metric-grid {{
+            display: grid;
+            grid-template-columns: repeat(var(--cols, 4), minmax(0, 1fr));
+            gap: 0.8rem 1rem;
+            margin-bottom: 0.8rem;
+        }}
+        .metric-label {{
+            font-size: 0.8rem;
+            color: #aaa;
+        }}
+        .metric-value {{
+            font-size: 1.6rem;
+            color: {COLORS['primary']};
+            text-shadow: 0 0 10px rgba(0, 255, 65, 0.5);
+        }}
+        .metric-delta {{
+            font-size: 0.8rem;
+            color: #888;
+        }}
     </style>
-"""
+""")
 
 # --- 映射表 ---
 FUTURES_MAP = {
@@ -121,6 +151,7 @@ ERROR_MESSAGES = {
     "no_data":           "⚠️ NO SIGNAL: {name} (請確認代號或市場開盤狀態)",
     "order_book_empty":  "ORDER BOOK DATA EMPTY (MARKET CLOSED?)",
     "twse_failed":       "DATA LINK FAILED (TWSE)",
+    "twstock_missing":   "TWSTOCK MODULE NOT INSTALLED (無法取得台股資料)",
     "connection_error":  "CONNECTION ERROR: {error}",
     "data_unavailable":  "DATA NOT AVAILABLE",
     "fetch_failed":      "DATA FETCH FAILED (無法獲取資料)",
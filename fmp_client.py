@@ -3,33 +3,162 @@ fmp_client.py — FMP API 封裝（2026 穩定版）
 支援 GLOBAL WATCHLIST、即時走勢、歷史K線、指數 (^TWII)
 """
 
+import hashlib
+import json
+import os
+import tempfile
+import time
+from datetime import date, timedelta
 import requests
+from requests.adapters import HTTPAdapter
+from tenacity import retry, stop_after_attempt, stop_after_delay, wait_exponential_jitter, retry_if_exception
+import numpy as np
 import pandas as pd
 import streamlit as st
-from typing import Optional, List
+from typing import Dict, Optional, List
 
 API_KEY = st.secrets.get("FMP_API_KEY", "").strip()
 BASE_URL = "https://financialmodelingprep.com/api/v3"
 STABLE_URL = "https://financialmodelingprep.com/stable"
+HISTORY_BATCH_SIZE = 5   # historical-price-full 逗號批次上限
+INTRADAY_LOOKBACK_DAYS = 3    # 盤中 1 分 K 回溯天數（涵蓋一般週末）
+INTRADAY_FALLBACK_DAYS = 14   # 短區間無資料時的回溯天數（農曆春節等長假）
+REQUEST_TIMEOUT = (3.05, 5)   # (連線, 讀取) 逾時秒數
+CACHE_DIR = os.environ.get("FMP_CACHE_DIR", ".cache/fmp")   # L2 磁碟快取目錄
+DISK_CACHE_TTL = 900          # L2 存活秒數（各端點共用，也是清理過期檔的門檻，disk_ttl 不應超過此值）
+DISK_CACHE_PRUNE_EVERY = 60   # 清理過期檔的最短間隔（秒）
 
-@st.cache_data(ttl=300)
-def fmp_get(endpoint: str, params: dict = None) -> dict:
-    """統一請求（自動加入 apikey）"""
+# 共用 Session：keep-alive 連線池，重用 TCP/TLS 連線省去每次握手
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8))
+_SESSION.headers.update({
+    "User-Agent": "shen-xiv-dashboard/1.0 (+requests)",
+    "Accept":     "application/json",
+})
+
+# ==================== L2 磁碟快取 ====================
+# st.cache_data 是 L1（記憶體，重啟即失效）；磁碟快取讓重啟 / 冷啟動的 worker 免打 API
+
+def _disk_cache_path(endpoint: str, params: dict) -> str:
+    key = endpoint + "?" + json.dumps(params, sort_keys=True)
+    return os.path.join(CACHE_DIR, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+
+def _disk_cache_read(path: str, ttl: int):
+    try:
+        if time.time() - os.path.getmtime(path) < ttl:
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _disk_cache_write(path: str, data) -> None:
+    # 先寫暫存檔再 os.replace，並行執行緒不會讀到寫一半的檔案
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except OSError:
+        pass
+    _disk_cache_prune()
+
+
+_last_prune = 0.0
+
+
+def _disk_cache_prune() -> None:
+    """
+    刪除超過 DISK_CACHE_TTL 的快取檔與殘留暫存檔，長時間運作的部署目錄不會無限增長
+    - 寫入時順便執行，且最多每 DISK_CACHE_PRUNE_EVERY 秒掃一次目錄
+    """
+    global _last_prune
+    now = time.time()
+    if now - _last_prune < DISK_CACHE_PRUNE_EVERY:
+        return
+    _last_prune = now
+    try:
+        entries = list(os.scandir(CACHE_DIR))
+    except OSError:
+        return
+    for entry in entries:
+        try:
+            if now - entry.stat().st_mtime >= DISK_CACHE_TTL:
+                os.remove(entry.path)
+        except OSError:
+            pass   # 其他執行緒已刪除或正在替換
+
+
+# ==================== Retry ====================
+
+def _is_transient(e: BaseException) -> bool:
+    """只重試暫時性錯誤：連線 / 逾時、429 限流、5xx；4xx 與 JSON 解析錯誤直接失敗"""
+    if isinstance(e, (requests.ConnectionError, requests.Timeout)):
+        return True
+    if isinstance(e, requests.HTTPError) and e.response is not None:
+        return e.response.status_code == 429 or e.response.status_code >= 500
+    return False
+
+
+# 重試有次數與總時長雙重上限：API 掛掉時單次重跑最多卡約 15 秒（最後一次嘗試仍可跑滿逾時），
+# 不會讓同步呼叫端（_get_sector、get_fundamentals_fmp…）把畫面凍結將近一分鐘
+@retry(
+    stop=stop_after_attempt(3) | stop_after_delay(10),  # 最多 3 次、累計 10 秒後不再重試
+    wait=wait_exponential_jitter(initial=0.5, max=2),
+    retry=retry_if_exception(_is_transient),
+    reraise=True,
+)
+def _request(endpoint: str, params: dict):
+    resp = _SESSION.get(endpoint, params=params, timeout=REQUEST_TIMEOUT)
+    resp.raise_for_status()
+    return resp.json()
+
+
+def fmp_request(endpoint: str, params: dict = None):
+    """
+    帶 apikey 的重試請求（不快取、不吞例外）
+    - 暫時性錯誤照樣退避重試；最終失敗直接拋出（4xx / 5xx → HTTPError，斷線 → RequestException），
+      供需要區分錯誤種類的呼叫端自行處理
+    """
+    return _request(endpoint, {**(params or {}), "apikey": API_KEY})
+
+
+def fmp_get(endpoint: str, params: dict = None, disk_ttl: int = 0) -> dict:
+    """
+    統一請求（自動加入 apikey；快取由各端點函數依資料性質設定 TTL）
+    - disk_ttl > 0 時先查 L2 磁碟快取，成功取得的回應也會寫回磁碟（錯誤訊息 dict 不寫）
+    - 暫時性錯誤指數退避重試；最終失敗回傳 {}，由外層 st.cache_data 快取到 TTL 為止，
+      重跑不會一直對同一檔打 API
+    """
     if not API_KEY:
         st.error("❌ FMP_API_KEY 未設定，請檢查 .streamlit/secrets.toml")
         return {}
     params = params or {}
-    params["apikey"] = API_KEY
+    cache_path = _disk_cache_path(endpoint, params) if disk_ttl else None
+    if cache_path:
+        cached = _disk_cache_read(cache_path, disk_ttl)
+        if cached is not None and not _is_error_payload(cached):
+            return cached
+
     try:
-        resp = requests.get(f"{endpoint}", params=params, timeout=10)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
+        data = fmp_request(endpoint, params)
+    except (requests.RequestException, ValueError) as e:
         st.error(f"FMP API 錯誤: {e}")
         return {}
+    if cache_path and data and not _is_error_payload(data):
+        _disk_cache_write(cache_path, data)
+    return data
+
+
+def _is_error_payload(data) -> bool:
+    """FMP 限流 / 金鑰無效等錯誤也可能以 200 + {"Error Message": ...} 回傳，這類回應不寫入磁碟快取"""
+    return isinstance(data, dict) and ("Error Message" in data or "error" in data)
 
 # ==================== 1. Batch Watchlist（取代原 get_watchlist_batch） ====================
-@st.cache_data(ttl=60)
+@st.cache_data(ttl=30, show_spinner=False)
 def get_watchlist_batch_fmp(tickers: tuple) -> dict:
     """批次即時報價（一次請求多檔）"""
     symbols = ",".join(tickers)
@@ -48,20 +177,37 @@ def get_watchlist_batch_fmp(tickers: tuple) -> dict:
     return result
 
 # ==================== 2. 歷史K線與 Intraday ====================
+_FMP_COLUMNS = {
+    "date": "Date", "open": "Open", "high": "High",
+    "low": "Low", "close": "Close", "volume": "Volume",
+}
+_PRICE_COLUMNS = ["Open", "High", "Low", "Close"]
+
+
 def _fmp_to_df(records: List[dict]) -> pd.DataFrame:
-    if not records:
+    """
+    FMP K 線 records → DataFrame（一次完成選欄、改名、日期轉型與排序）
+    - 建構時只取需要的 6 欄，不先建出 adjClose / vwap / label 等整張表再丟棄
+    - FMP 由新到舊回傳；指標計算與繪圖都假設時間遞增，這裡統一轉成由舊到新
+    - 時區正規化也在此完成（結果進 st.cache_data），下游不必每次重跑 tz_localize
+    - OHLC 降為 float32、Volume 降為能容納的最小整數型別：快取與繪圖的資料量減半；
+      指標計算會另轉 float64，不受精度影響
+    """
+    if not isinstance(records, list) or not records or "date" not in records[0]:
         return pd.DataFrame()
-    df = pd.DataFrame(records)
-    if "date" in df.columns:
-        df["Date"] = pd.to_datetime(df["date"])
-        df = df.rename(columns={
-            "open": "Open", "high": "High", "low": "Low",
-            "close": "Close", "volume": "Volume"
-        })
-        df = df[["Date", "Open", "High", "Low", "Close", "Volume"]]
+    df = pd.DataFrame(records, columns=list(_FMP_COLUMNS)).rename(columns=_FMP_COLUMNS)
+    df["Date"] = pd.to_datetime(df["Date"])
+    df[_PRICE_COLUMNS] = df[_PRICE_COLUMNS].astype(np.float32)
+    df["Volume"] = pd.to_numeric(df["Volume"], downcast="integer")
+    if df["Date"].dt.tz is not None:
+        df["Date"] = df["Date"].dt.tz_localize(None)
+    if not df["Date"].is_monotonic_increasing:
+        df = df.iloc[::-1].reset_index(drop=True)
+        if not df["Date"].is_monotonic_increasing:
+            df = df.sort_values("Date", ignore_index=True)
     return df
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=900, show_spinner=False)
 def get_history_data_fmp(ticker: str, period: str = "6mo", interval: str = "1d") -> Optional[pd.DataFrame]:
     """歷史K線（日/週/月）"""
     if ticker == "^TWII":
@@ -71,21 +217,86 @@ def get_history_data_fmp(ticker: str, period: str = "6mo", interval: str = "1d")
     else:
         endpoint = f"{STABLE_URL}/historical-chart/{interval}?symbol={ticker}"
     
-    data = fmp_get(endpoint)
+    data = fmp_get(endpoint, disk_ttl=DISK_CACHE_TTL)
     records = data.get("historical") if isinstance(data, dict) else data
     return _fmp_to_df(records)
 
-@st.cache_data(ttl=60)
+@st.cache_data(ttl=900, show_spinner=False)
+def get_history_batch_fmp(tickers: tuple) -> dict:
+    """批次日K（逗號串接多檔，每 HISTORY_BATCH_SIZE 檔一次請求）"""
+    result = {}
+    for i in range(0, len(tickers), HISTORY_BATCH_SIZE):
+        chunk = tickers[i:i + HISTORY_BATCH_SIZE]
+        data = fmp_get(f"{BASE_URL}/historical-price-full/{','.join(chunk)}", disk_ttl=DISK_CACHE_TTL)
+        for sym, records in _iter_stock_list(data):
+            result[sym] = _fmp_to_df(records)
+    return result
+
+
+def _iter_stock_list(data):
+    """多檔回傳 historicalStockList；單檔則直接是 {symbol, historical}"""
+    if not isinstance(data, dict):
+        return
+    for item in data.get("historicalStockList") or ([data] if "historical" in data else []):
+        sym = item.get("symbol")
+        if sym:
+            yield sym, item.get("historical")
+
+
+@st.cache_data(ttl=900, show_spinner=False)
+def get_recent_closes_fmp(tickers: tuple, n: int = 20) -> Dict[str, np.ndarray]:
+    """
+    跑馬燈 sparkline 用：每檔只取最近 n 筆收盤
+    - serietype=line + timeseries=n，回應只含 date / close 且只有 n 筆，不下載整段日K
+    - 直接轉成由舊到新的 float64 陣列，不建 DataFrame
+    """
+    params  = {"serietype": "line", "timeseries": n}
+    stocks  = [t for t in tickers if t != "^TWII"]
+    results = {}
+    for i in range(0, len(stocks), HISTORY_BATCH_SIZE):
+        chunk = stocks[i:i + HISTORY_BATCH_SIZE]
+        data  = fmp_get(f"{BASE_URL}/historical-price-full/{','.join(chunk)}", params)
+        for sym, records in _iter_stock_list(data):
+            results[sym] = records
+    if "^TWII" in tickers:
+        data = fmp_get(f"{BASE_URL}/historical-price-full/index/^TWII", params)
+        results["^TWII"] = data.get("historical") if isinstance(data, dict) else None
+
+    closes = {}
+    for sym, records in results.items():
+        if isinstance(records, list):
+            closes[sym] = np.array([r.get("close", np.nan) for r in reversed(records)], dtype=np.float64)
+    return closes
+
+def _fetch_intraday(ticker: str, days: int):
+    params = {
+        "symbol": ticker,
+        "from":   (date.today() - timedelta(days=days)).isoformat(),
+    }
+    return fmp_get(f"{STABLE_URL}/historical-chart/1min", params)
+
+
 def get_intraday_data_fmp(ticker: str) -> pd.DataFrame:
-    """盤中 1 分 K"""
-    endpoint = f"{STABLE_URL}/historical-chart/1min?symbol={ticker}"
-    data = fmp_get(endpoint)
-    return _fmp_to_df(data)
+    """
+    盤中 1 分 K（只保留最後一個交易日）
+    - 以 from 限定回溯區間，不下載完整的多日 1 分 K 再丟掉
+    - 先查短區間；只有回應是空清單（長假期間）才改用較長區間再查一次，
+      請求失敗（fmp_get 回傳 {}）不重查
+    - 不在此層快取：唯一呼叫端 utils.get_intraday_data 已快取 60 秒（含繪圖欄位）
+    """
+    data = _fetch_intraday(ticker, INTRADAY_LOOKBACK_DAYS)
+    if isinstance(data, list) and not data:
+        data = _fetch_intraday(ticker, INTRADAY_FALLBACK_DAYS)
+    df = _fmp_to_df(data)
+    if df.shape[0] == 0:
+        return df
+    day = df["Date"].dt.normalize()
+    return df[day == day.iloc[-1]].reset_index(drop=True)
 
 # ==================== 3. 基本面（已與 analysis.py 相容） ====================
-@st.cache_data(ttl=600)
+@st.cache_data(ttl=60, show_spinner=False)
 def get_fundamentals_fmp(ticker: str) -> dict:
-    """即時報價 + 基本面"""
+    """即時報價 + 基本面（quote 已含 P/E、EPS，一次請求即可，不另打 profile / key-metrics）"""
     quote = fmp_get(f"{BASE_URL}/quote/{ticker}")
     if isinstance(quote, list) and quote:
         q = quote[0]
@@ -97,5 +308,7 @@ def get_fundamentals_fmp(ticker: str) -> dict:
             "dayLow": q.get("dayLow"),
             "volume": q.get("volume"),
             "marketCap": q.get("marketCap"),
+            "trailingPE": q.get("pe"),
+            "trailingEps": q.get("eps"),
         }
     return {}
\ No newline at end of file
@@ -3,50 +3,66 @@ utils.py — SHEN XIV（已全面遷移至 FMP）
 資料獲取、計算與處理工具函數
 """
 
+import bisect
+import math
+import threading
 import streamlit as st
+import numpy as np
 import pandas as pd
-from typing import Optional, Tuple
-from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception
+from typing import Dict, List, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from _njit import njit, NUMBA_AVAILABLE
 
 # ==================== 從 fmp_client 匯入 ====================
 from fmp_client import (
     get_history_data_fmp,
+    get_history_batch_fmp,
     get_intraday_data_fmp,
+    get_recent_closes_fmp,
     get_fundamentals_fmp,
     get_watchlist_batch_fmp
 )
 
-# ==================== Retry 裝飾器 ====================
-_RETRY_CONDITION = retry_if_exception(
-    lambda e: any(k in str(e).lower() for k in ["rate limit", "429", "too many", "connection"])
-)
+# 網路錯誤已在 fmp_client.fmp_get 內處理（回傳 {}）；這一層只剩回應格式不符造成的解析錯誤
+_DATA_ERRORS = (KeyError, TypeError, ValueError, AttributeError, IndexError)
+
+
+# ==================== 台股代號表 ====================
 
-def retry_fmp(func):
-    """最多重試 4 次，等待 1→3→7→15 秒"""
-    return retry(
-        stop=stop_after_attempt(4),
-        wait=wait_exponential_jitter(initial=1, max=15),
-        retry=_RETRY_CONDITION,
-        reraise=True,
-    )(func)
+@st.cache_resource(show_spinner=False)
+def load_twstock():
+    """
+    延遲匯入 twstock（未安裝時回傳 None）
+    - twstock 一 import 就解析全部代號 CSV（數萬筆），只在台股路徑第一次用到時才載入，
+      美股 / 期貨頁面與冷啟動都不必付這筆成本
+    """
+    try:
+        import twstock
+    except ImportError:
+        return None
+    return twstock
+
+
+@st.cache_resource(show_spinner=False)
+def _load_code_names() -> Dict[str, str]:
+    """
+    code → "code 名稱" 查詢表，整個 process 的所有 session 共用
+    （側邊欄以代號輸入，不需要 名稱 → code 的反向表，也不必備妥選單清單）
+    - 不落地存檔：每次啟動都從 twstock.codes 重建，新上市 / 下市與 twstock 升級即時反映
+    """
+    twstock = load_twstock()
+    return {
+        code: f"{code} {info.name}"
+        for code, info in (twstock.codes if twstock is not None else {}).items()
+    }
 
 
 # ==================== Session State 初始化 ====================
 
 def init_session_state():
-    """初始化 session state，建立台股代號雙向查詢表"""
-    if "stock_map" not in st.session_state:
-        import twstock
-        st.session_state.stock_map = {
-            f"{code} {info.name}": code
-            for code, info in twstock.codes.items()
-        }
-    # 建立 reverse map（code → name）供快速查詢
-    if "stock_reverse_map" not in st.session_state:
-        st.session_state.stock_reverse_map = {
-            code: name_key
-            for name_key, code in st.session_state.stock_map.items()
-        }
+    """初始化 session state"""
+    # 台股代號表不放 session state：查詢一律走 _load_code_names() 的 process 共用快取
     # 自選股清單（預設跑馬燈標的）
     if "watchlist" not in st.session_state:
         st.session_state.watchlist = [
@@ -64,29 +80,51 @@ def init_session_state():
 
 
 def find_stock_name_by_code(target_code: str) -> str:
-    """O(1) 查詢（修正原本 O(N) 遍歷）"""
-    if "stock_reverse_map" not in st.session_state:
-        init_session_state()
-    return st.session_state.stock_reverse_map.get(target_code, f"CODE {target_code}")
+    """O(1) 查詢：單次 dict get，不依賴 session state"""
+    return _load_code_names().get(target_code, f"CODE {target_code}")
 
 
 # ==================== 格式化工具 ====================
 
+# 級距門檻 → 後綴：bucket 0 不縮寫，1 / 2 / 3 依序為 M / B / T
+_MAGNITUDE_EDGES  = (1e6, 1e9, 1e12)
+_MAGNITUDE_SCALE  = np.array((1.0,) + _MAGNITUDE_EDGES)
+_MAGNITUDE_SUFFIX = ("", "M", "B", "T")
+
+
 def format_number(number: float, prefix: str = "") -> str:
-    if number is None or number == 0:
+    if number is None or number == 0 or not math.isfinite(number):
         return "N/A"
-    abs_n = abs(number)
-    if abs_n >= 1e12:
-        return f"{prefix}{number/1e12:.2f}T"
-    elif abs_n >= 1e9:
-        return f"{prefix}{number/1e9:.2f}B"
-    elif abs_n >= 1e6:
-        return f"{prefix}{number/1e6:.2f}M"
-    else:
+    bucket = bisect.bisect_right(_MAGNITUDE_EDGES, abs(number))
+    if bucket == 0:
         return f"{prefix}{number:,.0f}"
+    return f"{prefix}{number / _MAGNITUDE_EDGES[bucket - 1]:.2f}{_MAGNITUDE_SUFFIX[bucket]}"
+
+
+def format_numbers(numbers, prefix: str = "") -> List[str]:
+    """
+    format_number 的批次版：級距以 np.digitize 一次判定、縮放整批向量化，
+    Python 端只剩逐筆字串格式化
+    """
+    arr    = np.asarray(numbers, dtype=np.float64)
+    bucket = np.digitize(np.abs(arr), _MAGNITUDE_EDGES)
+    scaled = arr / _MAGNITUDE_SCALE[bucket]
+    valid  = np.isfinite(arr) & (arr != 0)
+    return [
+        "N/A" if not ok else
+        f"{prefix}{x:,.0f}" if b == 0 else
+        f"{prefix}{x:.2f}{_MAGNITUDE_SUFFIX[b]}"
+        for x, b, ok in zip(scaled.tolist(), bucket.tolist(), valid.tolist())
+    ]
 
 
 def calculate_percentage_change(current: float, previous: float) -> Tuple[float, str]:
+    # 陣列路徑：整批向量化計算，方向箭頭以 np.where 產生
+    if isinstance(current, np.ndarray):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            change = (current - previous) / previous * 100
+        return change, np.where(change > 0, "▲", np.where(change < 0, "▼", "-"))
+
     if not previous or previous == 0:
         return 0.0, "-"
     change    = ((current - previous) / previous) * 100
@@ -96,39 +134,233 @@ def calculate_percentage_change(current: float, previous: float) -> Tuple[float,
 
 # ==================== 技術指標計算 ====================
 
+def _calculate_rsi(close: np.ndarray, window: int = 14) -> np.ndarray:
+    """RSI — Wilder's RMA（alpha=1/window），差分與漲跌拆分都在 NumPy 陣列上完成"""
+    delta = np.diff(close, prepend=close[0])
+    # 漲跌拆成兩欄，一次 ewm 同時平滑；fmax 將 NaN 差分視為 0（不讓缺值污染後續平均）
+    gain_loss = np.column_stack((np.fmax(delta, 0.0), np.fmax(-delta, 0.0)))
+    avg = pd.DataFrame(gain_loss).ewm(alpha=1 / window, min_periods=window, adjust=False).mean().to_numpy()
+    avg_gain, avg_loss = avg[:, 0], avg[:, 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rs = avg_gain / np.where(avg_loss == 0, np.nan, avg_loss)
+    rsi = 100 - (100 / (1 + rs))
+    return np.where(np.isnan(rsi), 50.0, rsi)
+
+
+def _sma_multi(close: np.ndarray, windows: Tuple[int, ...] = (5, 20)) -> Dict[int, np.ndarray]:
+    """
+    多條 SMA 共用一次 cumsum：sma_k[i] = (cs[i+1] - cs[i+1-k]) / k
+    - NaN 以 0 計入總和，另以 NaN 計數的 cumsum 把含 NaN 的視窗設回 NaN（同 rolling().mean()）
+    """
+    nan = np.isnan(close)
+    cs  = np.concatenate(([0.0], np.cumsum(np.where(nan, 0.0, close))))
+    cn  = np.concatenate(([0], np.cumsum(nan)))
+    out = {}
+    for k in windows:
+        sma = np.full(close.size, np.nan)
+        if close.size >= k:
+            tail = (cs[k:] - cs[:-k]) / k
+            tail[(cn[k:] - cn[:-k]) > 0] = np.nan
+            sma[k - 1:] = tail
+        out[k] = sma
+    return out
+
+
+@njit(cache=True)
+def _compute_indicators(close, n_rsi, n_fast, n_slow, n_std):
+    """
+    RSI / SMA(fast) / SMA(slow) / 布林上下軌 單次迴圈
+    - SMA 以滑動總和維護（加入新值、扣掉滑出值），窗內有 NaN 則輸出 NaN
+    - 布林通道另維護 slow 視窗的平方和，樣本標準差 (ddof=1) 同 rolling().std()
+    - RSI 維護 Wilder 平均漲跌幅，前 n_rsi-1 筆與無跌幅時為 50（同 _calculate_rsi）
+    """
+    n        = close.size
+    rsi      = np.full(n, 50.0)
+    sma_fast = np.full(n, np.nan)
+    sma_slow = np.full(n, np.nan)
+    bb_upper = np.full(n, np.nan)
+    bb_lower = np.full(n, np.nan)
+    alpha    = 1.0 / n_rsi
+    avg_gain = 0.0
+    avg_loss = 0.0
+    sum_fast = 0.0
+    sum_slow = 0.0
+    sq_slow  = 0.0
+    nan_fast = 0
+    nan_slow = 0
+
+    for i in range(n):
+        x = close[i]
+
+        # RSI
+        d = x - close[i - 1] if i > 0 else 0.0
+        g = d if d > 0 else 0.0
+        l = -d if d < 0 else 0.0
+        if i == 0:
+            avg_gain = g
+            avg_loss = l
+        else:
+            avg_gain = (1.0 - alpha) * avg_gain + alpha * g
+            avg_loss = (1.0 - alpha) * avg_loss + alpha * l
+        if i >= n_rsi - 1 and avg_loss != 0.0:
+            rsi[i] = 100.0 - 100.0 / (1.0 + avg_gain / avg_loss)
+
+        # SMA 滑動總和
+        if np.isnan(x):
+            nan_fast += 1
+            nan_slow += 1
+        else:
+            sum_fast += x
+            sum_slow += x
+            sq_slow  += x * x
+        if i >= n_fast:
+            y = close[i - n_fast]
+            if np.isnan(y):
+                nan_fast -= 1
+            else:
+                sum_fast -= y
+        if i >= n_slow:
+            y = close[i - n_slow]
+            if np.isnan(y):
+                nan_slow -= 1
+            else:
+                sum_slow -= y
+                sq_slow  -= y * y
+        if i >= n_fast - 1 and nan_fast == 0:
+            sma_fast[i] = sum_fast / n_fast
+        if i >= n_slow - 1 and nan_slow == 0:
+            mean        = sum_slow / n_slow
+            var         = max((sq_slow - sum_slow * mean) / (n_slow - 1), 0.0)
+            band        = n_std * np.sqrt(var)
+            sma_slow[i] = mean
+            bb_upper[i] = mean + band
+            bb_lower[i] = mean - band
+
+    return rsi, sma_fast, sma_slow, bb_upper, bb_lower
+
+
 def _calculate_indicators(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-
-    # RSI — Wilder's Smoothing（com=13 等同 alpha=1/14）
-    delta    = df["Close"].diff()
-    gain     = delta.where(delta > 0, 0)
-    loss     = -delta.where(delta < 0, 0)
-    avg_gain = gain.ewm(com=13, min_periods=14, adjust=False).mean()
-    avg_loss = loss.ewm(com=13, min_periods=14, adjust=False).mean()
-    rs       = avg_gain / avg_loss.replace(0, float("nan"))
-    df["RSI"] = (100 - (100 / (1 + rs))).fillna(50)
-
-    # Moving Averages
-    df["SMA5"]  = df["Close"].rolling(5).mean()
-    df["SMA20"] = df["Close"].rolling(20).mean()
-
-    # Bollinger Bands
-    std          = df["Close"].rolling(20).std()
-    df["BB_Upper"] = df["SMA20"] + std * 2
-    df["BB_Lower"] = df["SMA20"] - std * 2
+    """
+    各指標依自身視窗長度決定是否計算，資料不足的欄位直接不產生
+    （SMA5 ≥ 5、RSI ≥ 15、SMA20 / 布林 ≥ 20、MACD ≥ 26），圖表依欄位是否存在決定 trace
+    - 所有指標欄以單次 assign 加入，不逐欄插入造成 BlockManager 碎片化
+    - pandas 3 預設 copy-on-write，assign 只建新的 frame 物件、OHLCV 欄與輸入共用記憶體
+      （pandas 2.x 會整張深拷貝，故 requirements 要求 pandas>=3）
+    """
+    return df.assign(**_indicator_columns(df["Close"].to_numpy(dtype=np.float64)))
+
+
+@st.cache_data(ttl=900, max_entries=64, show_spinner=False)
+def _indicator_columns(close: np.ndarray) -> Dict[str, np.ndarray]:
+    """
+    以 Close 陣列內容為快取鍵：同一段收盤序列（例如單檔與批次抓取、只差 period 的請求）
+    只計算一次指標
+    """
+    n       = close.size
+    s_close = pd.Series(close)
+    cols    = {}
+
+    if NUMBA_AVAILABLE and n >= 20:
+        # 編譯後的單一迴圈一次算出 RSI / SMA5 / SMA20 / 布林通道
+        (cols["RSI"], cols["SMA5"], cols["SMA20"],
+         cols["BB_Upper"], cols["BB_Lower"]) = _compute_indicators(close, 14, 5, 20, 2.0)
+    else:
+        if n >= 15:
+            # RSI — Wilder's Smoothing（alpha=1/14）
+            cols["RSI"] = _calculate_rsi(close)
+        # SMA5 / SMA20 一次 cumsum 同時算出
+        windows = tuple(k for k in (5, 20) if n >= k)
+        for k, sma in _sma_multi(close, windows).items():
+            cols[f"SMA{k}"] = sma
+
+        # Bollinger Bands
+        if n >= 20:
+            std              = s_close.rolling(20).std().to_numpy()
+            cols["BB_Upper"] = cols["SMA20"] + std * 2
+            cols["BB_Lower"] = cols["SMA20"] - std * 2
 
     # MACD（新增）
-    ema12        = df["Close"].ewm(span=12, adjust=False).mean()
-    ema26        = df["Close"].ewm(span=26, adjust=False).mean()
-    df["MACD"]   = ema12 - ema26
-    df["Signal"] = df["MACD"].ewm(span=9, adjust=False).mean()
-
-    return df
+    if n >= 26:
+        macd           = s_close.ewm(span=12, adjust=False).mean() - s_close.ewm(span=26, adjust=False).mean()
+        cols["MACD"]   = macd.to_numpy()
+        cols["Signal"] = macd.ewm(span=9, adjust=False).mean().to_numpy()
+
+    return cols
+
+
+# ==================== 降採樣 ====================
+
+@njit(cache=True)
+def lttb(x, y, n_out):
+    """
+    Largest-Triangle-Three-Buckets：挑出 n_out 個最能保留折線形狀的點，回傳其索引
+    - 首尾兩點固定保留；其餘每桶取與「前一選點、下一桶平均點」圍成三角形面積最大者
+    - 回傳索引而非座標，呼叫端可用同一組索引取時間欄（datetime 無法進 njit）
+    """
+    n = x.size
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+
+    out    = np.empty(n_out, dtype=np.int64)
+    out[0] = 0
+    every  = (n - 2) / (n_out - 2)
+    a      = 0
+    for i in range(n_out - 2):
+        # 下一桶的平均點
+        avg_start = int(np.floor((i + 1) * every)) + 1
+        avg_end   = min(int(np.floor((i + 2) * every)) + 1, n)
+        avg_x     = 0.0
+        avg_y     = 0.0
+        for j in range(avg_start, avg_end):
+            avg_x += x[j]
+            avg_y += y[j]
+        avg_x /= avg_end - avg_start
+        avg_y /= avg_end - avg_start
+
+        # 本桶內與前一選點、下一桶平均點面積最大的點
+        ax       = x[a]
+        ay       = y[a]
+        max_area = -1.0
+        next_a   = int(np.floor(i * every)) + 1
+        for j in range(next_a, int(np.floor((i + 1) * every)) + 1):
+            area = abs((ax - avg_x) * (y[j] - ay) - (ax - x[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a   = j
+        out[i + 1] = next_a
+        a          = next_a
+
+    out[n_out - 1] = n - 1
+    return out
+
+
+# ==================== 並行請求 ====================
+
+def fetch_concurrently(*calls) -> list:
+    """
+    並行執行多個獨立的網路請求，總延遲 ≈ 最慢的一個
+    - calls: (func, *args) tuple
+    - 子執行緒掛上 ScriptRunContext，st.cache_data / st.error 才能正常運作
+    - 只有一個請求時（如兩檔日K已併成單一批次）直接在目前執行緒執行，不建執行緒池
+    """
+    if len(calls) == 1:
+        func, *args = calls[0]
+        return [func(*args)]
+
+    ctx = get_script_run_ctx()
+
+    def _run(func, *args):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+
+    with ThreadPoolExecutor(max_workers=len(calls)) as ex:
+        futures = [ex.submit(_run, *call) for call in calls]
+        return [f.result() for f in futures]
 
 
 # ==================== 公開資料獲取函數（已全面使用 FMP） ====================
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=900, show_spinner=False)
 def get_history_data(
     ticker: str,
     period: str = "6mo",
@@ -138,73 +370,148 @@ def get_history_data(
     """歷史K線（呼叫 FMP）"""
     try:
         df = get_history_data_fmp(ticker, period, interval)
-        if df is None or df.empty:
-            return None
+        return _prepare_history(df, include_indicators)
+    except _DATA_ERRORS as e:
+        st.error(f"Data Fetch Error ({ticker}): {e}")
+        return None
 
-        if pd.api.types.is_datetime64_any_dtype(df["Date"]):
-            df["Date"] = df["Date"].dt.tz_localize(None)
 
-        if include_indicators and len(df) > 26:
-            df = _calculate_indicators(df)
+@st.cache_data(ttl=900, show_spinner=False)
+def get_history_data_multi(
+    tickers: List[str],
+    period: str = "6mo",
+    interval: str = "1d",
+    include_indicators: bool = True,
+) -> Dict[str, Optional[pd.DataFrame]]:
+    """
+    多檔歷史K線：日K 合併成單次 FMP 批次請求，指數 / 非日K 逐檔抓取
+    - 批次請求與逐檔請求彼此獨立，並行送出，總延遲 ≈ 最慢的一個
+    - 整組結果（含指標）快取，重跑時不必再對批次結果逐檔計算指標
+    """
+    tickers   = list(dict.fromkeys(tickers))
+    batchable = tuple(t for t in tickers if interval == "1d" and t != "^TWII")
+    singles   = [t for t in tickers if t not in batchable]
+
+    # 每檔各自走 get_history_data，單檔快取照常命中；沒有可批次的標的時不多排一個空請求
+    calls = [(get_history_data, t, period, interval, include_indicators) for t in singles]
+    if batchable:
+        calls.append((_fetch_history_batch, batchable))
+    results = fetch_concurrently(*calls) if calls else []
+    batch   = results[-1] if batchable else {}
+
+    result = dict(zip(singles, results))
+    for t in batchable:
+        result[t] = _prepare_history(batch.get(t), include_indicators)
+    return {t: result[t] for t in tickers}
+
+
+def _fetch_history_batch(batchable: tuple) -> dict:
+    try:
+        return get_history_batch_fmp(batchable)
+    except _DATA_ERRORS as e:
+        st.error(f"Batch Fetch Error ({', '.join(batchable)}): {e}")
+        return {}
 
-        return df
-    except Exception as e:
-        st.error(f"Data Fetch Error ({ticker}): {e}")
+
+def _prepare_history(df: Optional[pd.DataFrame], include_indicators: bool) -> Optional[pd.DataFrame]:
+    if df is None or df.shape[0] == 0:
         return None
 
+    # Date 已在 fmp_client._fmp_to_df（快取內）轉成 naive datetime，這裡不再重做
+    if include_indicators and len(df) >= 5:
+        df = _calculate_indicators(df)
 
-@st.cache_data(ttl=60)
+    return df
+
+
+@st.cache_data(ttl=60, show_spinner=False)
 def get_intraday_data(ticker: str) -> pd.DataFrame:
-    """盤中走勢（呼叫 FMP）"""
+    """
+    盤中走勢（呼叫 FMP）
+    - Date 已是 naive 交易所時間，圖表直接拿來當時間軸，不另掛 Datetime 欄
+    """
     try:
         return get_intraday_data_fmp(ticker)
-    except Exception:
+    except _DATA_ERRORS:
         return pd.DataFrame()
 
 
-@st.cache_data(ttl=600)
+def get_recent_closes(tickers: tuple, n: int = 20) -> Dict[str, np.ndarray]:
+    """最近 n 筆收盤（呼叫 FMP），供跑馬燈 sparkline 使用"""
+    try:
+        return get_recent_closes_fmp(tickers, n)
+    except _DATA_ERRORS as e:
+        print(f"Sparkline fetch error: {e}")
+        return {}
+
+
+def clear_intraday_cache():
+    """手動刷新：清掉盤中快取，下次重跑立即重抓"""
+    get_intraday_data.clear()
+
+
+@st.cache_data(ttl=60, show_spinner=False)
 def get_fundamentals(ticker: str) -> dict:
     """基本面（呼叫 FMP）"""
     try:
         return get_fundamentals_fmp(ticker)
-    except Exception:
+    except _DATA_ERRORS:
         return {}
 
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=30, show_spinner=False)
 def get_watchlist_batch(tickers: tuple) -> dict:
     """批次下載跑馬燈標的（呼叫 FMP）"""
     try:
         return get_watchlist_batch_fmp(tickers)
-    except Exception as e:
+    except _DATA_ERRORS as e:
         print(f"Batch download error: {e}")
         return {}
 
 
 # ==================== 績效比較 ====================
 
+def _rebase_pct(a: np.ndarray) -> np.ndarray:
+    """(a / a[0] - 1) * 100：只配置一個輸出陣列，其餘步驟原地運算"""
+    out = a / a[0]
+    out -= 1.0
+    out *= 100.0
+    return out
+
+
+def _cum_returns(main: np.ndarray, bench: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """以首筆收盤為基準的累積報酬 (%)，直接在連續 float64 陣列上計算"""
+    return _rebase_pct(main), _rebase_pct(bench)
+
+
+def _close_by_date(df: pd.DataFrame) -> pd.Series:
+    return pd.Series(df["Close"].to_numpy(), index=pd.DatetimeIndex(df["Date"]))
+
+
 def calculate_returns(
     df_main: pd.DataFrame, df_bench: pd.DataFrame
 ) -> Optional[pd.DataFrame]:
     try:
-        df_merge = pd.merge(
-            df_main[["Date", "Close"]],
-            df_bench[["Date", "Close"]],
-            on="Date",
-            suffixes=("_Main", "_Bench"),
-            how="inner",
-        )
-        if df_merge.empty:
+        # 日期本身已排序且唯一：以 Date 為索引做 inner align，一次對齊兩邊，省去 merge 的 hash join
+        # 直接以 Close 建 Series，不對整張表 set_index（OHLCV 其餘欄不必跟著重建）
+        m, b = _close_by_date(df_main).align(_close_by_date(df_bench), join="inner")
+        if m.shape[0] == 0:
             return None
 
-        base_main  = df_merge["Close_Main"].iloc[0]
-        base_bench = df_merge["Close_Bench"].iloc[0]
-        if base_main == 0 or base_bench == 0:
+        idx   = m.index
+        main  = m.to_numpy(dtype=np.float64)
+        bench = b.to_numpy(dtype=np.float64)
+        if main[0] == 0 or bench[0] == 0:
             return None
 
-        df_merge["Return_Main"]  = (df_merge["Close_Main"]  / base_main  - 1) * 100
-        df_merge["Return_Bench"] = (df_merge["Close_Bench"] / base_bench - 1) * 100
-        return df_merge
-    except Exception as e:
+        ret_main, ret_bench = _cum_returns(main, bench)
+        return pd.DataFrame({
+            "Date":         idx,
+            "Close_Main":   main,
+            "Close_Bench":  bench,
+            "Return_Main":  ret_main,
+            "Return_Bench": ret_bench,
+        })
+    except _DATA_ERRORS as e:
         st.error(f"計算回報率時發生錯誤: {e}")
         return None
\ No newline at end of file